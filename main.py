@@ -1,27 +1,116 @@
 import ebooklib
 from ebooklib import epub
 from bs4 import BeautifulSoup
-import json
+import asyncio
+import io
+import logging
+import numpy as np
+import orjson
 import re
 import os
 import argparse
 import sys
-from indexing import initialize_components, create_storage_context_and_index, load_pages_from_jsonl, add_nodes_to_index
-from query import load_existing_index, create_query_engine, query_book, get_pages_by_position, get_current_position_context, summarize_page_range
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from indexing import initialize_components, load_pages_from_jsonl, pages_to_nodes, embed_and_insert_async
+from query import load_existing_index, create_query_engine, query_book, get_pages_by_position, get_current_position_context, summarize_page_range, invalidate_semantic_cache
 from llama_index.core import Settings
 
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+try:
+    from selectolax.parser import HTMLParser
+except ImportError:
+    HTMLParser = None
+
+log = logging.getLogger(__name__)
+
 PARAGRAPHS_PER_PAGE = 10  # Number of paragraphs that make up one "page"
 
+_WHITESPACE_RE = re.compile(r'\s+')
+_BRACKETS_RE = re.compile(r'\[.*?\]')  # Text in square brackets (footnote markers etc.)
+_NON_SPACE_WS_RE = re.compile(r'[^\S ]')  # Any whitespace except a plain space
+
 # Clean and Parse
 def clean_text(text):
     """
     Clean text by removing excessive whitespace and unwanted artifacts
     """
-    text = re.sub(r'\s+', ' ', text)
-    text = text.strip()
-    text = re.sub(r'\[.*?\]', '', text)  # Remove text in square brackets
-    text = re.sub(r'\s+', ' ', text)  # Clean up spaces again
-    return text
+    # Fast path: most paragraphs have no brackets and no whitespace runs,
+    # so two cheap checks avoid the rewrite machinery entirely. It must
+    # only trigger when rewriting is provably a no-op: no double spaces
+    # and no whitespace other than plain spaces (tabs, newlines, \xa0...)
+    if '[' not in text:
+        stripped = text.strip()
+        if '  ' not in stripped and _NON_SPACE_WS_RE.search(stripped) is None:
+            return stripped
+
+    return _WHITESPACE_RE.sub(' ', _BRACKETS_RE.sub('', text)).strip()
+
+
+def iter_headings_and_paragraphs(content):
+    """
+    Yield (tag, text) pairs for every h1/h2/p element in an XHTML document,
+    in document order.
+
+    Prefers a streaming lxml iterparse walk, which pulls one element at a
+    time and clears it after use so memory stays constant regardless of
+    document size. Falls back to selectolax, then BeautifulSoup with the
+    stdlib html.parser (this rung only runs when lxml is missing, so the
+    lxml tree builder is not an option), both of which materialize the
+    full element list.
+    """
+    if etree is not None:
+        for _, element in etree.iterparse(io.BytesIO(content), events=('end',),
+                                          tag=('{*}h1', '{*}h2', '{*}p'),
+                                          html=True, recover=True):
+            tag = element.tag.rsplit('}', 1)[-1]
+            yield tag, ''.join(element.itertext()).strip()
+            element.clear()
+    elif HTMLParser is not None:
+        for node in HTMLParser(content).css('h1, h2, p'):
+            yield node.tag, node.text(strip=True)
+    else:
+        soup = BeautifulSoup(content, 'html.parser')
+        for element in soup.find_all(['h1', 'h2', 'p']):
+            yield element.name, element.get_text(strip=True)
+
+
+def _process_item(content, item_name):
+    """
+    Parse one XHTML document into a list of (text, chapter, section) dicts.
+    Top-level so it can be pickled for ProcessPoolExecutor workers.
+    Chapter/section state is local to a document, so items can be
+    processed independently; ids are assigned by the caller afterwards.
+    """
+    paragraphs = []
+    current_chapter = None
+    current_section = None
+
+    for tag, text in iter_headings_and_paragraphs(content):
+        if tag == 'h1':
+            current_chapter = text
+            current_section = None  # Reset section when new chapter starts
+
+        elif tag == 'h2':
+            current_section = text
+
+        elif tag == 'p':
+            if text:  # Only process non-empty paragraphs
+                cleaned_text = clean_text(text)
+
+                if cleaned_text:  # Only add if text remains after cleaning
+                    paragraphs.append({
+                        'text': cleaned_text,
+                        'source_file': item_name,
+                        'chapter': current_chapter,
+                        'section': current_section
+                    })
+
+    return paragraphs
 
 
 # Extract, Parse, Clean, and Enrich with Metadata
@@ -29,103 +118,155 @@ def process_epub_to_pages(book, book_title=None, author=None):
     """
     Process EPUB and create pages with metadata for RAG system.
     Each page represents a paragraph with its contextual metadata.
+    Documents are parsed in parallel across CPU cores, then paragraph
+    ids are assigned in document order.
     """
     # Try to extract metadata from EPUB if not provided
     if book_title is None:
         book_title = book.get_metadata('DC', 'title')
         book_title = book_title[0][0] if book_title else 'Unknown'
-    
+
     if author is None:
         author = book.get_metadata('DC', 'creator')
         author = author[0][0] if author else 'Unknown'
-    
+
+    documents = [(item.get_content(), item.get_name())
+                 for item in book.get_items()
+                 if item.get_type() == ebooklib.ITEM_DOCUMENT]
+
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        results = list(executor.map(_process_item,
+                                    [content for content, _ in documents],
+                                    [name for _, name in documents]))
+
     pages = []
     paragraph_id = 0
-    
-    for item in book.get_items():
-        if item.get_type() == ebooklib.ITEM_DOCUMENT:
-            content = item.get_content()
-            soup = BeautifulSoup(content, 'html.parser')
-            
-            current_chapter = None
-            current_section = None
-            
-            for element in soup.find_all(['h1', 'h2', 'p']):
-                if element.name == 'h1':
-                    current_chapter = element.get_text(strip=True)
-                    current_section = None  # Reset section when new chapter starts
-                    
-                elif element.name == 'h2':
-                    current_section = element.get_text(strip=True)
-                    
-                elif element.name == 'p':
-                    text = element.get_text(strip=True)
-                    
-                    if text:  # Only process non-empty paragraphs
-                        cleaned_text = clean_text(text)
-                        
-                        if cleaned_text:  # Only add if text remains after cleaning
-                            paragraph = {
-                                'id': paragraph_id,
-                                'text': cleaned_text,
-                                'metadata': {
-                                    'source_file': item.get_name(),
-                                    'chapter': current_chapter,
-                                    'section': current_section,
-                                    'book_title': book_title,
-                                    'author': author,
-                                    'position': paragraph_id
-                                }
-                            }
-                            
-                            pages.append(paragraph)
-                            paragraph_id += 1
-    
+
+    for item_paragraphs in results:
+        for paragraph in item_paragraphs:
+            pages.append({
+                'id': paragraph_id,
+                'text': paragraph['text'],
+                'metadata': {
+                    'source_file': paragraph['source_file'],
+                    'chapter': paragraph['chapter'],
+                    'section': paragraph['section'],
+                    'book_title': book_title,
+                    'author': author,
+                    'position': paragraph_id
+                }
+            })
+            paragraph_id += 1
+
     return pages
 
 
 # Format and Write as JSONL
 def write_pages_to_jsonl(pages, output_filename='book_pages.jsonl'):
     """
-    Write pages to JSONL file (one JSON object per line)
+    Write pages to JSONL file (one JSON object per line).
+
+    Also writes sidecar files used by get_pages_by_position:
+    - '.posidx.npy': int64 (N, 3) array of (position, offset, length)
+      rows, binary-searchable for direct seeks into the JSONL
+    - '.text.bin' / '.offsets.npy' / '.meta.json': columnar layout
+      (concatenated UTF-8 text, int64 start offsets, per-column metadata)
+      so range queries can slice bytes without parsing any JSON.
     """
-    with open(output_filename, 'w', encoding='utf-8') as f:
-        for page in pages:
-            json.dump(page, f, ensure_ascii=False)
-            f.write('\n')
+    position_index = np.empty((len(pages), 3), dtype=np.int64)
+    with open(output_filename, 'wb') as f:
+        for i, page in enumerate(pages):
+            line = orjson.dumps(page) + b'\n'
+            position_index[i] = (page['metadata'].get('position', page['id']),
+                                 f.tell(), len(line))
+            f.write(line)
+
+    np.save(output_filename + '.posidx.npy', position_index)
 
+    text_offsets = np.empty(len(pages) + 1, dtype=np.int64)
+    position = 0
+    with open(output_filename + '.text.bin', 'wb') as f:
+        for i, page in enumerate(pages):
+            text_offsets[i] = position
+            data = page['text'].encode('utf-8')
+            f.write(data)
+            position += len(data)
+    text_offsets[len(pages)] = position
+    np.save(output_filename + '.offsets.npy', text_offsets)
 
-def setup_system(book_path, pages_file, chroma_db_path, model_name):
+    columns = {
+        'source_file': [page['metadata']['source_file'] for page in pages],
+        'chapter': [page['metadata']['chapter'] for page in pages],
+        'section': [page['metadata']['section'] for page in pages],
+        'book_title': pages[0]['metadata']['book_title'] if pages else 'Unknown',
+        'author': pages[0]['metadata']['author'] if pages else 'Unknown'
+    }
+    with open(output_filename + '.meta.json', 'wb') as f:
+        f.write(orjson.dumps(columns))
+
+
+def setup_system(book_path, pages_file, chroma_db_path, model_name, batch_size=128,
+                 embed_backend='ollama', quantize=False, chroma_host=None, chroma_port=8000):
     """
     Initial setup: Process EPUB and create index if not already done.
+
+    When the EPUB is processed in this invocation, the in-memory pages are
+    indexed directly and the JSONL is written by a background thread, so
+    the first run doesn't serialize the whole book to disk and immediately
+    parse it back.
     """
+    pages = None
+    writer_thread = None
+
     if not os.path.exists(pages_file):
         print("Processing EPUB file...")
         book = epub.read_epub(book_path)
         pages = process_epub_to_pages(book)
         print(f"Created {len(pages)} pages")
-        
-        print("Writing pages to JSONL...")
-        write_pages_to_jsonl(pages, pages_file)
-        print(f"Saved to {pages_file}")
+
+        print("Writing pages to JSONL in the background...")
+        writer_thread = threading.Thread(target=write_pages_to_jsonl,
+                                         args=(pages, pages_file), daemon=True)
+        writer_thread.start()
     else:
         print(f"Pages file already exists: {pages_file}")
-    
-    if not os.path.exists(chroma_db_path):
+
+    # The join must happen even if indexing fails (e.g. Ollama is not
+    # running): dying with the daemon writer mid-write would leave a
+    # truncated pages file that a later run would trust and silently
+    # index as the whole book.
+    try:
+        # Check before initialize_components: creating the PersistentClient
+        # brings the chroma_db directory into existence.
+        needs_index = not os.path.exists(chroma_db_path)
+
         print(f"\nInitializing components (Ollama with {model_name})...")
-        chroma_collection = initialize_components(model_name=model_name)
-        
-        print("Creating index...")
-        storage_context, index = create_storage_context_and_index(chroma_collection)
-        
-        print("Loading pages and creating nodes...")
-        nodes = load_pages_from_jsonl(pages_file)
-        
-        print(f"Indexing {len(nodes)} nodes...")
-        add_nodes_to_index(index, nodes)
-        print("Index created successfully!")
-    else:
-        print("Index already exists")
+        chroma_collection = initialize_components(model_name=model_name,
+                                                  embed_backend=embed_backend,
+                                                  chroma_host=chroma_host,
+                                                  chroma_port=chroma_port)
+
+        if needs_index:
+            if pages is not None:
+                print("Creating nodes from in-memory pages...")
+                nodes = pages_to_nodes(pages)
+            else:
+                print("Loading pages and creating nodes...")
+                nodes = load_pages_from_jsonl(pages_file)
+
+            print(f"Indexing {len(nodes)} nodes (batch size {batch_size})...")
+            asyncio.run(embed_and_insert_async(chroma_collection, nodes,
+                                               model_name=model_name, batch_size=batch_size,
+                                               embed_backend=embed_backend, quantize=quantize,
+                                               chroma_host=chroma_host, chroma_port=chroma_port))
+            invalidate_semantic_cache()
+            print("Index created successfully!")
+        else:
+            print("Index already exists")
+    finally:
+        if writer_thread is not None:
+            writer_thread.join()
+            print(f"Saved to {pages_file}")
 
 
 def display_menu():
@@ -138,8 +279,9 @@ def display_menu():
     print("\n1. Ask a question about the book")
     print("2. Summarize pages by position range (e.g., pages 5-10)")
     print("3. Summarize last N pages before current position (e.g., last 3 pages before page 15)")
-    print("4. Exit")
-    print("\nEnter your choice (1-4): ", end="")
+    print("4. Ask a question about a page range (e.g., pages 50-80)")
+    print("5. Exit")
+    print("\nEnter your choice (1-5): ", end="")
 
 
 def handle_question(query_engine):
@@ -153,10 +295,10 @@ def handle_question(query_engine):
     print("2. AUGMENT: Adding context to prompt...")
     print("3. GENERATE: Generating answer...")
     
-    print(f"[DEBUG] About to call query_book with question: '{question}'")
+    log.debug("About to call query_book with question: '%s'", question)
     try:
         response = query_book(query_engine, question)
-        print(f"[DEBUG] Returned from query_book")
+        log.debug("Returned from query_book")
     except Exception as e:
         print(f"\n✗ ERROR: {type(e).__name__}: {str(e)}")
         if "timeout" in str(e).lower():
@@ -170,8 +312,14 @@ def handle_question(query_engine):
     print("\n" + "=" * 80)
     print("ANSWER:")
     print("=" * 80)
-    print(response.response)
-    
+    if hasattr(response, 'response_gen'):
+        # Streaming engine: print tokens as the LLM produces them
+        for token in response.response_gen:
+            print(token, end='', flush=True)
+        print()
+    else:
+        print(response.response)
+
     if hasattr(response, 'source_nodes') and response.source_nodes:
         print("\n" + "=" * 80)
         print("SOURCES:")
@@ -190,7 +338,7 @@ def handle_question(query_engine):
         print("- There's an issue with the embeddings")
 
 
-def handle_range_summary(pages_file):
+def handle_range_summary(pages_file, index=None):
     """
     Summarize a specific range of pages.
     """
@@ -211,9 +359,10 @@ def handle_range_summary(pages_file):
         
         print(f"Found {len(pages)} pages across {end_page - start_page + 1} pages")
         print("\nGenerating summary...")
-        
-        summary = summarize_page_range(Settings.llm, pages)
-        
+
+        summary = summarize_page_range(Settings.llm, pages,
+                                       book_meta=getattr(index, '_book_meta', None))
+
         print("\n" + "=" * 80)
         print(f"SUMMARY (Pages {start_page}-{end_page}):")
         print("=" * 80)
@@ -223,7 +372,7 @@ def handle_range_summary(pages_file):
         print("Invalid input. Please enter numbers.")
 
 
-def handle_context_summary(pages_file):
+def handle_context_summary(pages_file, index=None):
     """
     Summarize N pages before a current page position.
     """
@@ -248,24 +397,28 @@ def handle_context_summary(pages_file):
         
         print(f"\nFound {len(pages)} pages across {num_pages} pages")
         
-        # Group paragraphs by page for display
+        # Group paragraphs by page and collect each page's chapters in a
+        # single pass. Dicts keep chapters unique in reading order, so
+        # the display is stable (sets iterate in arbitrary order).
         page_groups = {}
+        page_chapters = {}
         for page in pages:
             page_pos = page.get('id', page['metadata'].get('position', 'N/A'))
             page_num = page_pos // PARAGRAPHS_PER_PAGE
-            if page_num not in page_groups:
-                page_groups[page_num] = []
-            page_groups[page_num].append(page)
-        
+            page_groups.setdefault(page_num, []).append(page)
+            chapter = page['metadata'].get('chapter')
+            if chapter:
+                page_chapters.setdefault(page_num, {})[chapter] = None
+
         # Display page summary
-        for page_num in sorted(page_groups.keys()):
-            page_items = page_groups[page_num]
-            chapters = set(c['metadata'].get('chapter') for c in page_items if c['metadata'].get('chapter'))
+        for page_num in sorted(page_groups):
+            chapters = page_chapters.get(page_num)
             chapter_str = ', '.join(chapters) if chapters else 'Unknown'
-            print(f"  - Page {page_num}: {len(page_items)} paragraphs ({chapter_str})")
+            print(f"  - Page {page_num}: {len(page_groups[page_num])} paragraphs ({chapter_str})")
         
         print("\nGenerating summary...")
-        summary = summarize_page_range(Settings.llm, pages)
+        summary = summarize_page_range(Settings.llm, pages,
+                                       book_meta=getattr(index, '_book_meta', None))
         
         print("\n" + "=" * 80)
         print(f"SUMMARY (Pages {start_page}-{end_page}):")
@@ -276,6 +429,54 @@ def handle_context_summary(pages_file):
         print("Invalid input. Please enter numbers.")
 
 
+def handle_range_question(index, top_k):
+    """
+    Ask a question restricted to a specific page range. The range is
+    pushed down into the vector store as a position metadata filter, so
+    similarity search only considers pages inside the range.
+    """
+    try:
+        start_page = int(input("\nEnter start page number: "))
+        end_page = int(input("Enter end page number: "))
+    except ValueError:
+        print("Invalid input. Please enter numbers.")
+        return
+
+    question = input("Enter your question: ")
+
+    # Convert pages to paragraph positions
+    start_pos = start_page * PARAGRAPHS_PER_PAGE
+    end_pos = (end_page + 1) * PARAGRAPHS_PER_PAGE - 1
+
+    print(f"\nSearching pages {start_page} to {end_page} (paragraphs {start_pos}-{end_pos})...")
+    query_engine = create_query_engine(index, top_k=top_k, similarity_cutoff=0.0,
+                                       position_range=(start_pos, end_pos))
+
+    try:
+        response = query_book(query_engine, question)
+    except Exception as e:
+        print(f"\n✗ ERROR: {type(e).__name__}: {str(e)}")
+        return
+
+    print("\n" + "=" * 80)
+    print(f"ANSWER (Pages {start_page}-{end_page}):")
+    print("=" * 80)
+    print(response.response)
+
+    if hasattr(response, 'source_nodes') and response.source_nodes:
+        print("\n" + "=" * 80)
+        print("SOURCES:")
+        print("=" * 80)
+        for i, node in enumerate(response.source_nodes, 1):
+            print(f"\nSource {i}:")
+            print(f"  Score: {node.score:.4f}")
+            print(f"  Chapter: {node.metadata.get('chapter', 'Unknown')}")
+            print(f"  Position: {node.metadata.get('position', 'N/A')}")
+            print(f"  Preview: {node.text[:150]}...")
+    else:
+        print("\nNo source pages were retrieved in that range.")
+
+
 def parse_arguments():
     """
     Parse command-line arguments.
@@ -306,6 +507,20 @@ Models (sorted by speed):
                         help='Output directory for pages and database (default: current directory)')
     parser.add_argument('-k', '--top-k', type=int, default=5,
                         help='Number of pages to retrieve for each query (default: 5)')
+    parser.add_argument('-b', '--batch-size', type=int, default=128,
+                        help='Number of nodes to insert into the index per batch (default: 128)')
+    parser.add_argument('-e', '--embed-backend', type=str, default='ollama',
+                        choices=['ollama', 'tei'],
+                        help='Embedding backend: ollama, or tei for a local '
+                             'Text Embeddings Inference server (default: ollama)')
+    parser.add_argument('-q', '--quantize', action='store_true',
+                        help='Snap embeddings to an int8 grid at indexing time '
+                             'so quantized similarity kernels can be used later')
+    parser.add_argument('--chroma-host', type=str, default=None,
+                        help='Host of a standalone Chroma server (chroma run); '
+                             'default is the in-process persistent client')
+    parser.add_argument('--chroma-port', type=int, default=8000,
+                        help='Port of the standalone Chroma server (default: 8000)')
     
     args = parser.parse_args()
     
@@ -343,12 +558,14 @@ def main():
     print(f"Top-K retrieval: {args.top_k}")
     print("=" * 80)
     
-    setup_system(args.book, pages_file, chroma_db_path, args.model)
+    setup_system(args.book, pages_file, chroma_db_path, args.model, batch_size=args.batch_size,
+                 embed_backend=args.embed_backend, quantize=args.quantize,
+                 chroma_host=args.chroma_host, chroma_port=args.chroma_port)
     
     print("\nInitializing query components...")
-    initialize_components(model_name=args.model)
     index = load_existing_index()
-    query_engine = create_query_engine(index, top_k=args.top_k, similarity_cutoff=0.0)
+    query_engine = create_query_engine(index, top_k=args.top_k, similarity_cutoff=0.0,
+                                       streaming=True)
     
     print("\nSystem ready!")
     
@@ -359,14 +576,16 @@ def main():
         if choice == '1':
             handle_question(query_engine)
         elif choice == '2':
-            handle_range_summary(pages_file)
+            handle_range_summary(pages_file, index)
         elif choice == '3':
-            handle_context_summary(pages_file)
+            handle_context_summary(pages_file, index)
         elif choice == '4':
+            handle_range_question(index, args.top_k)
+        elif choice == '5':
             print("\nGoodbye!")
             break
         else:
-            print("\nInvalid choice. Please enter 1-4.")
+            print("\nInvalid choice. Please enter 1-5.")
 
 
 if __name__ == "__main__":
@@ -1,30 +1,317 @@
 import chromadb
-from llama_index.core import VectorStoreIndex, StorageContext
+from functools import lru_cache
+from llama_index.core import VectorStoreIndex, StorageContext, Settings
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.core.retrievers import VectorIndexRetriever
 from llama_index.core.query_engine import RetrieverQueryEngine
 from llama_index.core.postprocessor import SimilarityPostprocessor
 from llama_index.core.schema import QueryBundle
-import json
+from llama_index.core.base.response.schema import Response
+from llama_index.core.vector_stores import MetadataFilters, MetadataFilter, FilterOperator
+import asyncio
+import logging
+import mmap
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import time
+import numpy as np
+import orjson
+from indexing import COLLECTION_NAME, PERSIST_DIRECTORY, normalize_embeddings, quantize_embeddings_int8
 
+log = logging.getLogger(__name__)
 
-def load_existing_index(collection_name="book_pages", persist_directory="./chroma_db"):
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+_RULE = "-" * 80
+_DOUBLE_RULE = "=" * 80
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _dot_products(query, matrix):
+        n, d = matrix.shape
+        out = np.empty(n, np.float32)
+        for i in prange(n):
+            s = np.float32(0.0)
+            for j in range(d):
+                s += query[j] * matrix[i, j]
+            out[i] = s
+        return out
+else:
+    _dot_products = None
+
+
+def cosine_similarities(query, matrix):
+    """
+    Cosine similarity of one query vector against every row of a matrix.
+
+    Uses SimSIMD's AVX/NEON-vectorized kernel when installed (several
+    times faster than generic NumPy dispatch for single-query batches).
+    Without SimSIMD, the dot products run through a Numba-jitted parallel
+    kernel when numba is available (cached to disk so compilation is paid
+    once), and plain NumPy otherwise. Rows need not be normalized.
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    query = np.ascontiguousarray(query, dtype=np.float32)
+
+    if simsimd is not None:
+        distances = simsimd.cdist(query[np.newaxis, :], matrix, metric='cosine')
+        return 1.0 - np.asarray(distances, dtype=np.float32)[0]
+
+    if _dot_products is not None:
+        dots = _dot_products(query, matrix)
+    else:
+        dots = matrix @ query
+
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    norms[norms == 0] = 1.0
+    return dots / norms
+
+
+# One PersistentClient per directory: each client re-opens sqlite and the
+# HNSW segments, so collections in the same directory should share one
+_CHROMA_CLIENTS = {}
+
+
+def _get_chroma_client(persist_directory):
+    client = _CHROMA_CLIENTS.get(persist_directory)
+    if client is None:
+        client = chromadb.PersistentClient(path=persist_directory)
+        _CHROMA_CLIENTS[persist_directory] = client
+    return client
+
+
+@lru_cache(maxsize=8)
+def load_existing_index(collection_name=COLLECTION_NAME, persist_directory=PERSIST_DIRECTORY):
     """
     Load the existing index from ChromaDB.
+
+    Memoized per (collection, directory): repeat calls in a long-running
+    process return the already-built index instead of re-opening the
+    collection and rebuilding the VectorStoreIndex.
     """
-    print(f"[DEBUG] Loading index from {persist_directory}, collection: {collection_name}")
-    chroma_client = chromadb.PersistentClient(path=persist_directory)
+    log.debug("Loading index from %s, collection: %s", persist_directory, collection_name)
+    chroma_client = _get_chroma_client(persist_directory)
     chroma_collection = chroma_client.get_collection(collection_name)
-    
-    print(f"[DEBUG] Collection count: {chroma_collection.count()}")
-    
+
+    space = (chroma_collection.metadata or {}).get("hnsw:space")
+    if space != "ip":
+        log.warning("Collection uses '%s' distance; re-index the book to get "
+                    "inner-product search over pre-normalized embeddings", space or 'l2')
+
     vector_store = ChromaVectorStore(chroma_collection=chroma_collection)
     index = VectorStoreIndex.from_vector_store(vector_store)
-    
-    print(f"[DEBUG] Index loaded successfully")
+
+    # Book title/author are constant across the collection; read them off
+    # one arbitrary row now so summarization calls don't have to dig them
+    # out of page metadata every time.
+    peeked = chroma_collection.peek(1).get("metadatas") or [{}]
+    index._book_meta = {
+        "book_title": peeked[0].get("book_title"),
+        "author": peeked[0].get("author"),
+    }
+
+    log.debug("Index loaded successfully")
     return index
 
 
+class SemanticQueryCache:
+    """
+    Cache of (query embedding, response) pairs for near-duplicate
+    questions.
+
+    A lookup L2-normalizes the question embedding and scores it against
+    all cached embeddings with a single matrix-vector product; the best
+    match wins if its cosine similarity reaches the threshold. Hits skip
+    both retrieval and LLM generation, turning a multi-second query into
+    a matrix multiply over a few hundred rows. Entries expire after ttl
+    seconds and the least recently used entry is evicted once max_size
+    is reached.
+
+    Entries carry an opaque scope (the engine configuration they were
+    answered under); lookups only match entries with the same scope, so
+    an answer produced by a position-filtered or fast engine is never
+    served for a whole-book question or vice versa.
+    """
+
+    def __init__(self, threshold=0.97, max_size=256, ttl=3600.0):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.RLock()
+        self._embeddings = None  # float32 (n, d), rows L2-normalized
+        self._entries = []       # [last_used_timestamp, response, scope] per row
+
+    @staticmethod
+    def _normalize(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self):
+        now = time.time()
+        keep = [i for i, entry in enumerate(self._entries) if now - entry[0] <= self.ttl]
+        if len(keep) < len(self._entries):
+            self.evictions += len(self._entries) - len(keep)
+            self._entries = [self._entries[i] for i in keep]
+            self._embeddings = self._embeddings[keep] if keep else None
+
+    def get(self, embedding, scope=None):
+        """
+        Return the cached response for a similar-enough query answered
+        under the same scope, or None.
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            self._expire()
+            if self._embeddings is None:
+                self.misses += 1
+                return None
+            rows = [i for i, entry in enumerate(self._entries) if entry[2] == scope]
+            if not rows:
+                self.misses += 1
+                return None
+            scores = cosine_similarities(query, self._embeddings[rows])
+            best_local = int(np.argmax(scores))
+            if scores[best_local] >= self.threshold:
+                best = rows[best_local]
+                self.hits += 1
+                self._entries[best][0] = time.time()
+                return self._entries[best][1]
+            self.misses += 1
+            return None
+
+    def put(self, embedding, response, scope=None):
+        row = self._normalize(embedding)[np.newaxis, :]
+        with self._lock:
+            if self._embeddings is None:
+                self._embeddings = row
+            else:
+                self._embeddings = np.vstack([self._embeddings, row])
+            self._entries.append([time.time(), response, scope])
+            if len(self._entries) > self.max_size:
+                oldest = min(range(len(self._entries)), key=lambda i: self._entries[i][0])
+                del self._entries[oldest]
+                self._embeddings = np.delete(self._embeddings, oldest, axis=0)
+                self.evictions += 1
+
+    def invalidate(self):
+        """
+        Drop all entries. Called after ingestion so stale answers never
+        outlive the index contents they were generated from.
+        """
+        with self._lock:
+            self._embeddings = None
+            self._entries = []
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._entries), 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+
+_SEMANTIC_CACHE = SemanticQueryCache()
+
+
+def invalidate_semantic_cache():
+    """
+    Invalidate the shared semantic query cache (call after ingestion).
+    """
+    _SEMANTIC_CACHE.invalidate()
+
+
+_QUESTION_WS_RE = re.compile(r'\s+')
+
+
+def _normalize_question(question):
+    """
+    Canonical embedding-cache key: collapsed whitespace, lowercased.
+    Questions differing only in spacing or case share one embedding.
+    """
+    return _QUESTION_WS_RE.sub(' ', question.strip()).lower()
+
+
+@lru_cache(maxsize=4096)
+def _embed_query_cached(normalized_question):
+    embedding = Settings.embed_model.get_query_embedding(normalized_question)
+    return tuple(float(x) for x in normalize_embeddings(embedding))
+
+
+def _embed_query(question):
+    """
+    Embed a query string, memoized so asking the same question twice
+    (modulo whitespace and case) skips the Ollama round-trip entirely.
+    The embedding is L2-normalized to match the stored vectors in the
+    inner-product collection. Returns a tuple so the cached value is
+    hashable and immutable.
+    """
+    return _embed_query_cached(_normalize_question(question))
+
+
+def embedding_cache_stats():
+    """
+    Hit/miss statistics for the query-embedding cache.
+    """
+    return _embed_query_cached.cache_info()._asdict()
+
+
+# Retrievers and query engines already built in this process. Retriever
+# construction re-wires postprocessors, prompt templates, and callback
+# managers every time, which is pure overhead when the configuration has
+# not changed. Keyed by id(index) plus configuration; the index itself is
+# stored alongside so a recycled id() of a collected index can never
+# serve a stale retriever. LRU-bounded (keys include the user-supplied
+# position range, which is unbounded in an interactive session).
+_FACTORY_CACHE_MAXSIZE = 32
+_RETRIEVER_CACHE = OrderedDict()
+_ENGINE_CACHE = OrderedDict()
+
+
+def _cache_insert(cache, key, value):
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > _FACTORY_CACHE_MAXSIZE:
+        cache.popitem(last=False)
+
+
+def _get_retriever(index, top_k, position_range=None):
+    key = (id(index), top_k, position_range)
+    cached = _RETRIEVER_CACHE.get(key)
+    if cached is not None and cached[0] is index:
+        _RETRIEVER_CACHE.move_to_end(key)
+        return cached[1]
+
+    filters = None
+    if position_range is not None:
+        start_pos, end_pos = position_range
+        filters = MetadataFilters(filters=[
+            MetadataFilter(key='position', operator=FilterOperator.GTE, value=start_pos),
+            MetadataFilter(key='position', operator=FilterOperator.LTE, value=end_pos)
+        ])
+
+    retriever = VectorIndexRetriever(
+        index=index,
+        similarity_top_k=top_k,
+        filters=filters,
+    )
+    _cache_insert(_RETRIEVER_CACHE, key, (index, retriever))
+    return retriever
+
+
 def retrieve_relevant_pages(index, query, top_k=5, similarity_cutoff=0.7):
     """
     Retrieve: Find the most relevant pages from the database.
@@ -38,90 +325,381 @@ def retrieve_relevant_pages(index, query, top_k=5, similarity_cutoff=0.7):
     Returns:
         List of retrieved nodes with their scores
     """
-    print(f"[DEBUG] retrieve_relevant_chunks called with query: '{query}'")
-    print(f"[DEBUG] top_k={top_k}, similarity_cutoff={similarity_cutoff}")
-    
-    retriever = VectorIndexRetriever(
-        index=index,
-        similarity_top_k=top_k,
-    )
-    
-    retrieved_nodes = retriever.retrieve(query)
-    print(f"[DEBUG] Retrieved {len(retrieved_nodes)} nodes")
-    for i, node in enumerate(retrieved_nodes[:3]):  # Show first 3
-        print(f"[DEBUG] Node {i}: score={node.score:.4f}, text_preview={node.text[:100]}...")
+    log.debug("retrieve_relevant_pages called with query: '%s'", query)
+    log.debug("top_k=%d, similarity_cutoff=%s", top_k, similarity_cutoff)
+
+    retriever = _get_retriever(index, top_k)
+
+    query_bundle = QueryBundle(query_str=query, embedding=list(_embed_query(query)))
+    retrieved_nodes = retriever.retrieve(query_bundle)
+    log.debug("Retrieved %d nodes", len(retrieved_nodes))
+    if log.isEnabledFor(logging.DEBUG):
+        for i, node in enumerate(retrieved_nodes[:3]):  # Show first 3
+            log.debug("Node %d: score=%.4f, text_preview=%.100s...", i, node.score, node.text)
     
     return retrieved_nodes
 
 
-def create_query_engine(index, top_k=5, similarity_cutoff=0.7):
+# Whole-collection embedding matrices for the exact rerank stage, stored
+# packed: fewer bytes through cache/DRAM per dot product than float32.
+# Keyed by collection name; rebuilt when the collection count changes.
+#
+# 'int8' (default) is the smallest at 4x compression; 'f16' keeps full
+# dynamic range at 2x compression, and SimSIMD has a native f16 cosine
+# kernel so the halved lanes translate directly into throughput.
+_RERANK_DTYPE = 'int8'
+_RERANK_CACHE = {}
+
+
+def _get_rerank_matrix(chroma_collection, dtype=None):
+    """
+    Load (and cache) the collection's stored embeddings as a packed
+    matrix ('int8' with scale, or 'f16'), with an id -> row mapping for
+    candidate lookups.
+    """
+    if dtype is None:
+        dtype = _RERANK_DTYPE
+    entry = _RERANK_CACHE.get(chroma_collection.name)
+    if entry is None or entry['dtype'] != dtype or entry['count'] != chroma_collection.count():
+        # include only embeddings: every extra field in include= is a
+        # separate sqlite column read plus per-row deserialization
+        stored = chroma_collection.get(include=["embeddings"])
+        matrix = np.asarray(stored["embeddings"], dtype=np.float32)
+        if dtype == 'f16':
+            packed, scale = matrix.astype(np.float16), None
+        else:
+            packed, scale = quantize_embeddings_int8(matrix)
+        entry = {
+            'count': len(stored['ids']),
+            'row_of': {node_id: i for i, node_id in enumerate(stored['ids'])},
+            'matrix': packed,
+            'scale': scale,
+            'dtype': dtype
+        }
+        _RERANK_CACHE[chroma_collection.name] = entry
+    return entry
+
+
+def _score_candidates_packed(query_vector, candidate_matrix):
+    """
+    Cosine scores of the query against packed (int8 or f16) candidate
+    rows. The query is packed to match: int8 quantization uses the
+    query's own scale, which drops out of cosine similarity.
+    """
+    if candidate_matrix.dtype == np.float16:
+        query_packed = query_vector.astype(np.float16)
+    else:
+        query_packed, _ = quantize_embeddings_int8(query_vector)
+    if simsimd is not None:
+        distances = simsimd.cdist(query_packed[np.newaxis, :], candidate_matrix, metric='cosine')
+        return 1.0 - np.asarray(distances, dtype=np.float32)[0]
+    return cosine_similarities(query_vector, candidate_matrix.astype(np.float32))
+
+
+def retrieve_with_rerank(index, chroma_collection, query, top_k=5, candidate_k=100,
+                         early_stop_score=0.95):
+    """
+    Two-stage cascade retrieval: a wide, cheap ANN pass followed by an
+    exact rerank.
+
+    Stage 1 asks HNSW for candidate_k approximate candidates, decoupling
+    recall from the index's query-time accuracy. If the best approximate
+    score already clears early_stop_score, the top_k candidates are
+    returned as-is. Otherwise stage 2 fetches the candidates' stored
+    embeddings from the collection and reranks all of them with the
+    exact cosine kernel, which costs under a millisecond for ~100
+    vectors.
+
+    Returns the top_k nodes with exact scores.
+    """
+    retriever = _get_retriever(index, candidate_k)
+    query_embedding = list(_embed_query(query))
+    query_bundle = QueryBundle(query_str=query, embedding=query_embedding)
+    candidates = retriever.retrieve(query_bundle)
+    if not candidates:
+        return []
+
+    if candidates[0].score is not None and candidates[0].score >= early_stop_score:
+        log.debug("Rerank skipped: stage-1 top score %.4f", candidates[0].score)
+        return candidates[:top_k]
+
+    query_vector = np.asarray(query_embedding, dtype=np.float32)
+
+    # Preferred: slice candidate rows out of the cached packed matrix
+    # for the whole collection, so the rerank touches no storage at all
+    entry = _get_rerank_matrix(chroma_collection)
+    rows = [entry['row_of'].get(node.node_id) for node in candidates]
+    if all(row is not None for row in rows):
+        scores = _score_candidates_packed(query_vector, entry['matrix'][rows])
+        for node, score in zip(candidates, scores):
+            node.score = float(score)
+    else:
+        # Cache is stale for some candidate; fetch exact fp32 embeddings
+        stored = chroma_collection.get(ids=[node.node_id for node in candidates],
+                                       include=["embeddings"])
+        matrix = np.asarray(stored["embeddings"], dtype=np.float32)
+        # Chroma may return rows in a different order than requested
+        row_of = {node_id: i for i, node_id in enumerate(stored["ids"])}
+        scores = cosine_similarities(query_vector, matrix)
+        for node in candidates:
+            node.score = float(scores[row_of[node.node_id]])
+
+    candidates.sort(key=lambda node: node.score, reverse=True)
+    return candidates[:top_k]
+
+
+def create_query_engine(index, top_k=5, similarity_cutoff=0.7, position_range=None,
+                        streaming=False, enable_similarity_filter=True, fast=False):
     """
     Create a query engine that handles Retrieve, Augment, and Generate.
-    
+
     The query engine will:
     1. Retrieve the most relevant chunks
     2. Augment the prompt with retrieved context
     3. Generate an answer using the LLM
+
+    position_range: optional (start_pos, end_pos) tuple. When given, the
+    position metadata filter is pushed down into the vector store so the
+    candidate set shrinks before similarity search runs.
+
+    streaming: when True the engine returns a StreamingResponse whose
+    response_gen yields tokens as the LLM produces them, so callers can
+    print the answer incrementally instead of waiting for the full text.
+
+    enable_similarity_filter: set False to skip the SimilarityPostprocessor
+    stage. fast=True is the shorthand for simple factual questions: no
+    postprocessors and top_k capped at 3, trading a little recall for a
+    smaller prompt and less retrieval work.
     """
-    print(f"[DEBUG] Creating query engine with top_k={top_k}, similarity_cutoff={similarity_cutoff}")
-    
-    retriever = VectorIndexRetriever(
-        index=index,
-        similarity_top_k=top_k,
-    )
-    
+    if fast:
+        enable_similarity_filter = False
+        top_k = min(top_k, 3)
+
+    key = (id(index), top_k, similarity_cutoff, position_range,
+           streaming, enable_similarity_filter)
+    cached = _ENGINE_CACHE.get(key)
+    if cached is not None and cached[0] is index:
+        _ENGINE_CACHE.move_to_end(key)
+        return cached[1]
+
+    log.debug("Creating query engine with top_k=%d, similarity_cutoff=%s, fast=%s",
+              top_k, similarity_cutoff, fast)
+
+    retriever = _get_retriever(index, top_k, position_range)
+
+    node_postprocessors = []
+    if enable_similarity_filter:
+        node_postprocessors.append(SimilarityPostprocessor(similarity_cutoff=similarity_cutoff))
+
     query_engine = RetrieverQueryEngine.from_args(
         retriever=retriever,
-        node_postprocessors=[SimilarityPostprocessor(similarity_cutoff=similarity_cutoff)]
+        node_postprocessors=node_postprocessors,
+        streaming=streaming
     )
-    
-    print(f"[DEBUG] Query engine created successfully")
+    # Stamp the configuration onto the engine so the semantic cache can
+    # scope answers to it (a range-filtered answer must never be served
+    # for a whole-book question, or vice versa)
+    query_engine._cache_scope = key
+
+    _cache_insert(_ENGINE_CACHE, key, (index, query_engine))
+    log.debug("Query engine created successfully")
     return query_engine
 
 
-def query_book(query_engine, question):
+def _caching_token_gen(token_gen, streaming_response, embedding, semantic_cache, scope):
+    """
+    Pass tokens through while accumulating them; once the stream is
+    exhausted, the full answer is cached as a materialized Response so a
+    repeat of the question is served instantly instead of re-streamed.
+    """
+    parts = []
+    for token in token_gen:
+        parts.append(token)
+        yield token
+    semantic_cache.put(embedding, Response(
+        response="".join(parts),
+        source_nodes=getattr(streaming_response, 'source_nodes', None),
+        metadata=getattr(streaming_response, 'metadata', None),
+    ), scope)
+
+
+def query_book(query_engine, question, semantic_cache=_SEMANTIC_CACHE):
     """
     Query the book with a question.
-    
+
     This performs:
     1. Retrieve: Gets relevant chunks from the vector database
     2. Augment: Adds the chunks as context to the prompt
     3. Generate: LLM generates answer based only on the context
-    
+
+    Questions within the semantic cache's cosine threshold of an earlier
+    question return that answer directly, skipping steps 1-3 entirely.
+    Pass semantic_cache=None to force a fresh query.
+
     Args:
         query_engine: The configured query engine
         question: User's question
-    
+        semantic_cache: SemanticQueryCache to consult, or None
+
     Returns:
         Response object with answer and source information
     """
-    print(f"[DEBUG] query_book called with question: '{question}'")
-    response = query_engine.query(question)
-    print(f"[DEBUG] Response received")
-    print(f"[DEBUG] Response type: {type(response)}")
-    print(f"[DEBUG] Response.response: '{response.response}'")
-    print(f"[DEBUG] Response has {len(response.source_nodes) if hasattr(response, 'source_nodes') else 0} source nodes")
+    log.debug("query_book called with question: '%s'", question)
+    embedding = list(_embed_query(question))
+
+    # Answers are cached under the engine's configuration (stamped by
+    # create_query_engine), so engines with different filters or modes
+    # never exchange answers
+    scope = getattr(query_engine, '_cache_scope', None)
+
+    if semantic_cache is not None:
+        cached = semantic_cache.get(embedding, scope)
+        if cached is not None:
+            log.debug("Semantic cache hit (%s)", semantic_cache.stats())
+            return cached
+
+    query_bundle = QueryBundle(query_str=question, embedding=embedding)
+    response = query_engine.query(query_bundle)
+
+    # Streaming responses are single-use generators, so they cannot be
+    # cached directly; instead the token generator is wrapped so that
+    # fully consuming it materializes a Response and caches that.
+    if semantic_cache is not None:
+        if hasattr(response, 'response_gen'):
+            response.response_gen = _caching_token_gen(
+                response.response_gen, response, embedding, semantic_cache, scope)
+        else:
+            semantic_cache.put(embedding, response, scope)
+    log.debug("Response received, type: %s", type(response))
+    if log.isEnabledFor(logging.DEBUG):
+        if not hasattr(response, 'response_gen'):
+            log.debug("Response.response: '%s'", response.response)
+        log.debug("Response has %d source nodes",
+                  len(response.source_nodes) if hasattr(response, 'source_nodes') else 0)
     return response
 
 
+def stream_query_book(query_engine, question, semantic_cache=_SEMANTIC_CACHE):
+    """
+    Query the book and yield the answer incrementally.
+
+    With a streaming query engine (create_query_engine(streaming=True)),
+    tokens are yielded as the LLM produces them, so time-to-first-output
+    is prefill plus one token instead of the full generation. Semantic
+    cache hits are already materialized and come back as a single chunk;
+    misses stream, and fully consuming the stream populates the cache.
+    """
+    response = query_book(query_engine, question, semantic_cache)
+    if hasattr(response, 'response_gen'):
+        yield from response.response_gen
+    else:
+        yield response.response
+
+
+def query_book_multi(index, questions, top_k=5, max_workers=4):
+    """
+    Answer several sub-questions with one LLM call, running their
+    retrieval stages in parallel.
+
+    Chroma's HNSW search happens in native code that releases the GIL,
+    so a small thread pool overlaps retrieval across sub-queries.
+    Embeddings go through the shared _embed_query cache, so repeated
+    sub-questions skip the embedding round-trip. Retrieved nodes are
+    merged and deduplicated by id (keeping each node's best score)
+    before a single generation pass over the combined context.
+
+    Args:
+        index: The VectorStoreIndex
+        questions: List of sub-questions
+        top_k: Nodes to retrieve per sub-question
+        max_workers: Thread pool size for the retrieval stage
+
+    Returns:
+        (answer text, merged list of source nodes)
+    """
+    retriever = _get_retriever(index, top_k)
+
+    def retrieve(question):
+        bundle = QueryBundle(query_str=question, embedding=list(_embed_query(question)))
+        return retriever.retrieve(bundle)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(retrieve, questions))
+
+    merged = {}
+    for nodes in results:
+        for node in nodes:
+            existing = merged.get(node.node_id)
+            if existing is None or (node.score or 0.0) > (existing.score or 0.0):
+                merged[node.node_id] = node
+    source_nodes = sorted(merged.values(), key=lambda node: node.score or 0.0, reverse=True)
+
+    context = "\n\n".join(node.text for node in source_nodes)
+    question_list = "\n".join(f"- {question}" for question in questions)
+    prompt = f"""Answer the following questions using only the provided context.
+
+Questions:
+{question_list}
+
+Context:
+
+{context}
+
+Answers:"""
+
+    response = Settings.llm.complete(prompt)
+    return response.text, source_nodes
+
+
 def display_response(response):
     """
     Display the response with sources.
+
+    The output is assembled into one string and written with a single
+    stdout write, instead of one syscall-plus-flush per print.
     """
-    print("Answer:")
-    print("-" * 80)
-    print(response.response)
-    print("\n" + "=" * 80)
-    print("Sources:")
-    print("=" * 80)
-    
+    parts = [
+        "Answer:",
+        _RULE,
+        response.response,
+        "\n" + _DOUBLE_RULE,
+        "Sources:",
+        _DOUBLE_RULE,
+    ]
+
     for i, node in enumerate(response.source_nodes, 1):
-        print(f"\nSource {i}:")
-        print(f"Similarity Score: {node.score:.4f}")
-        print(f"Chapter: {node.metadata.get('chapter', 'Unknown')}")
-        print(f"Section: {node.metadata.get('section', 'N/A')}")
-        print(f"Text Preview: {node.text[:200]}...")
-        print("-" * 80)
+        parts.append(f"\nSource {i}:")
+        parts.append(f"Similarity Score: {node.score:.4f}")
+        parts.append(f"Chapter: {node.metadata.get('chapter', 'Unknown')}")
+        parts.append(f"Section: {node.metadata.get('section', 'N/A')}")
+        parts.append(f"Text Preview: {node.text[:200]}...")
+        parts.append(_RULE)
+
+    sys.stdout.write("\n".join(parts))
+    sys.stdout.write("\n")
+
+
+def _load_position_index(jsonl_file):
+    """
+    Load the (position, offset, length) index for a JSONL file, building
+    and persisting it with one streaming pass on first use. Positions
+    are written in ascending order, so the array is binary-searchable.
+    """
+    index_file = jsonl_file + '.posidx.npy'
+    if os.path.exists(index_file):
+        return np.load(index_file)
+
+    rows = []
+    offset = 0
+    with open(jsonl_file, 'rb', buffering=1 << 20) as f:
+        for line in f:
+            page = orjson.loads(line)
+            rows.append((page['metadata'].get('position', page['id']), offset, len(line)))
+            offset += len(line)
+
+    position_index = np.asarray(rows, dtype=np.int64) if rows else np.empty((0, 3), dtype=np.int64)
+    np.save(index_file, position_index)
+    return position_index
 
 
 def get_pages_by_position(jsonl_file, start_position, end_position):
@@ -138,47 +716,106 @@ def get_pages_by_position(jsonl_file, start_position, end_position):
         List of pages in the specified range
     """
     pages = []
-    
-    with open(jsonl_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            page = json.loads(line)
-            page_pos = page['metadata'].get('position', page['id'])
-            
-            if start_position <= page_pos <= end_position:
-                pages.append(page)
-    
+
+    # Fastest path: the columnar sidecars written by write_pages_to_jsonl
+    # (text blob + offset array + metadata columns). Positions are
+    # contiguous ids, so a range is a single byte slice of the blob with
+    # no JSON parsing at all.
+    text_file = jsonl_file + '.text.bin'
+    offsets_file = jsonl_file + '.offsets.npy'
+    meta_file = jsonl_file + '.meta.json'
+    if os.path.exists(text_file) and os.path.exists(offsets_file) and os.path.exists(meta_file):
+        text_offsets = np.load(offsets_file)
+        with open(meta_file, 'rb') as f:
+            columns = orjson.loads(f.read())
+
+        num_pages = len(text_offsets) - 1
+        start = max(0, start_position)
+        end = min(end_position, num_pages - 1)
+        if start > end:
+            return pages
+
+        with open(text_file, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                blob = mm[text_offsets[start]:text_offsets[end + 1]]
+            finally:
+                mm.close()
+
+        base = text_offsets[start]
+        for position in range(start, end + 1):
+            text = blob[text_offsets[position] - base:text_offsets[position + 1] - base].decode('utf-8')
+            pages.append({
+                'id': position,
+                'text': text,
+                'metadata': {
+                    'source_file': columns['source_file'][position],
+                    'chapter': columns['chapter'][position],
+                    'section': columns['section'][position],
+                    'book_title': columns['book_title'],
+                    'author': columns['author'],
+                    'position': position
+                }
+            })
+
+        return pages
+
+    # Otherwise use the position index sidecar (built on first use for
+    # JSONL files that don't ship one): binary-search the requested range
+    # and read just those lines, instead of parsing the whole file.
+    position_index = _load_position_index(jsonl_file)
+    positions = position_index[:, 0]
+    lo = int(np.searchsorted(positions, start_position, side='left'))
+    hi = int(np.searchsorted(positions, end_position, side='right'))
+    if lo == hi:
+        return pages
+
+    with open(jsonl_file, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for _, offset, length in position_index[lo:hi]:
+                pages.append(orjson.loads(mm[offset:offset + length]))
+        finally:
+            mm.close()
+
     return pages
 
 
-def summarize_page_range(llm, pages, custom_prompt=None):
+def _build_summary_prompt(pages, custom_prompt=None, book_meta=None):
     """
-    Summarize a range of pages using the LLM.
-    Pages are treated as a cohesive unit (like pages in a book).
-    
-    Args:
-        llm: The LLM instance (from Settings.llm)
-        pages: List of page dictionaries
-        custom_prompt: Optional custom prompt template
-    
-    Returns:
-        Summary generated by the LLM
+    Build the summarization prompt for a list of page dictionaries.
+
+    book_meta, when given, supplies the book title/author (as stashed on
+    the index by load_existing_index) instead of reading them from page
+    metadata.
     """
-    # Combine all page texts into a single narrative
-    combined_text = "\n\n".join([page['text'] for page in pages])
-    
-    # Get metadata for context
-    chapters = set(page['metadata'].get('chapter') for page in pages if page['metadata'].get('chapter'))
+    # Collect texts and chapters column-wise in a single pass over the
+    # pages instead of one traversal per field. A dict keeps chapters
+    # unique while preserving reading order.
+    texts = []
+    chapters = {}
+    for page in pages:
+        texts.append(page['text'])
+        chapter = page['metadata'].get('chapter')
+        if chapter:
+            chapters[chapter] = None
+
+    combined_text = "\n\n".join(texts)
+
+    if custom_prompt:
+        return custom_prompt.format(text=combined_text)
+
     chapter_info = f" from chapter(s): {', '.join(chapters)}" if chapters else ""
-    
-    # Extract book title and author from page metadata
-    book_title = pages[0]['metadata'].get('book_title', 'Unknown') if pages else 'Unknown'
-    author = pages[0]['metadata'].get('author', 'Unknown') if pages else 'Unknown'
+
+    # Book title and author: prefer the metadata stashed at index load
+    # time, falling back to the first page's metadata
+    if book_meta is None:
+        book_meta = pages[0]['metadata'] if pages else {}
+    book_title = book_meta.get('book_title') or 'Unknown'
+    author = book_meta.get('author') or 'Unknown'
     book_context = f' the book "{book_title}" by {author}' if book_title != 'Unknown' else ' this book'
-    
-    if custom_prompt:
-        prompt = custom_prompt.format(text=combined_text)
-    else:
-        prompt = f"""You are summarizing a section of{book_context}{chapter_info}.
+
+    return f"""You are summarizing a section of{book_context}{chapter_info}.
 
 Provide a comprehensive but concise summary of the following text. Focus on:
 - Main events or discoveries described
@@ -191,11 +828,93 @@ Text to summarize:
 {combined_text}
 
 Summary:"""
-    
-    response = llm.complete(prompt)
+
+
+# Map-reduce kicks in above this many pages; below it a single prompt is
+# both faster (one round-trip) and more coherent.
+_MAP_REDUCE_THRESHOLD = 30
+_MAP_GROUP_SIZE = 10
+
+
+def _summarize_map_reduce(llm, pages, custom_prompt=None, book_meta=None,
+                          group_size=_MAP_GROUP_SIZE):
+    """
+    Hierarchical summarization: summarize fixed-size groups of pages
+    concurrently (map), then summarize the partial summaries (reduce).
+
+    Each prompt stays small enough for short-context models, and the map
+    step runs under asyncio.gather so wall time is one map round plus the
+    reduce call rather than the sum of all group summaries.
+    """
+    groups = [pages[i:i + group_size] for i in range(0, len(pages), group_size)]
+    prompts = [_build_summary_prompt(group, custom_prompt, book_meta) for group in groups]
+
+    async def _map_all():
+        responses = await asyncio.gather(*(llm.acomplete(prompt) for prompt in prompts))
+        return [response.text for response in responses]
+
+    partials = asyncio.run(_map_all())
+
+    # Reduce reuses the same prompt builder: each partial summary becomes
+    # a pseudo-page carrying its group's metadata, so chapter and book
+    # context survive into the final prompt.
+    reduce_pages = [
+        {'text': partial, 'metadata': group[0]['metadata']}
+        for partial, group in zip(partials, groups)
+    ]
+    response = llm.complete(_build_summary_prompt(reduce_pages, custom_prompt, book_meta))
+    return response.text
+
+
+def summarize_page_range(llm, pages, custom_prompt=None, book_meta=None):
+    """
+    Summarize a range of pages using the LLM.
+    Pages are treated as a cohesive unit (like pages in a book).
+
+    Long ranges are summarized hierarchically (map-reduce) so the prompt
+    never outgrows the model's context window.
+
+    Args:
+        llm: The LLM instance (from Settings.llm)
+        pages: List of page dictionaries
+        custom_prompt: Optional custom prompt template
+        book_meta: Optional dict with book_title/author (e.g.
+            index._book_meta); avoids re-reading them from page metadata
+
+    Returns:
+        Summary generated by the LLM
+    """
+    if len(pages) > _MAP_REDUCE_THRESHOLD:
+        return _summarize_map_reduce(llm, pages, custom_prompt, book_meta)
+    response = llm.complete(_build_summary_prompt(pages, custom_prompt, book_meta))
     return response.text
 
 
+def summarize_page_ranges(llm, page_ranges, custom_prompt=None, book_meta=None):
+    """
+    Summarize several page ranges concurrently.
+
+    One prompt is built per range and all completions are dispatched
+    together with asyncio.gather over llm.acomplete, so total wall time
+    tracks the slowest range instead of the sum of all of them.
+
+    Args:
+        llm: The LLM instance (from Settings.llm)
+        page_ranges: List of page-dictionary lists, one per range
+        custom_prompt: Optional custom prompt template
+
+    Returns:
+        List of summaries, in the same order as page_ranges
+    """
+    prompts = [_build_summary_prompt(pages, custom_prompt, book_meta) for pages in page_ranges]
+
+    async def _complete_all():
+        responses = await asyncio.gather(*(llm.acomplete(prompt) for prompt in prompts))
+        return [response.text for response in responses]
+
+    return asyncio.run(_complete_all())
+
+
 def get_current_position_context(jsonl_file, current_position, num_pages_before=5):
     """
     Get context around a current reading position.